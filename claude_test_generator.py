@@ -4,20 +4,185 @@ Claude Test Generator - A demo tool to generate tests for existing Python
 projects.
 """
 
+import ast
+import dataclasses
+import errno
+import functools
+import hashlib
+import json
+import os
+import tempfile
 import anyio
 from pathlib import Path
-from typing import List, Optional
-from claude_code_sdk import query, ClaudeCodeOptions
-from dotenv import load_dotenv
+from typing import Dict, List, Optional
 
 
-load_dotenv()
+# The Claude Code SDK is slow to import, so the names we use from it are
+# only imported when first needed (see __getattr__ and _sdk).
+_SDK_NAMES = ("query", "ClaudeCodeOptions", "ProcessError")
+
+
+def __getattr__(name: str):
+    """Import the Claude Code SDK the first time one of its names is used."""
+    if name not in _SDK_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    import claude_code_sdk
+
+    # setdefault keeps any name that was already replaced, e.g. by a test
+    # patching claude_test_generator.query.
+    for sdk_name in _SDK_NAMES:
+        globals().setdefault(sdk_name, getattr(claude_code_sdk, sdk_name))
+    return globals()[name]
+
+
+def _sdk(name: str):
+    """Return a Claude Code SDK name, importing the SDK on first use."""
+    try:
+        return globals()[name]
+    except KeyError:
+        return __getattr__(name)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_env() -> None:
+    """Load environment variables from .env once per process."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+
+# Instructions shared by every request. They are sent as part of the system
+# prompt rather than the per-file prompt so the prefix stays byte-identical
+# across calls and can be served from Anthropic's prompt cache.
+TEST_GENERATION_INSTRUCTIONS = """\
+When asked to generate tests for a Python file, generate tests that:
+1. Cover all functions and methods
+2. Test edge cases and error conditions
+3. Use appropriate assertions
+4. Follow the best practices of the requested testing framework
+5. Include proper imports and setup
+"""
+
+# Bump whenever the prompt or instructions change so cached responses
+# generated from an older prompt are no longer used.
+PROMPT_VERSION = b"1"
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "claude_test_gen"
+
+# Records the sources each test file in an output directory was generated
+# from, so unchanged files can be skipped on the next run.
+MANIFEST_NAME = ".manifest.json"
+
+# Files that never get tests generated for them
+SKIP_FILE_NAMES = frozenset({"__init__.py", "conftest.py", "setup.py"})
+SKIP_FILE_PREFIXES = ("test_",)
+
+# Turn budget per file: one turn per BYTES_PER_TURN bytes of source, at
+# least MIN_TURNS, capped at the generator's max_turns.
+MIN_TURNS = 3
+BYTES_PER_TURN = 4_000
+
+# Exponential backoff, in seconds, between retries of failed Claude Code
+# runs (e.g. when the API is rate limiting us). The SDK's ProcessError only
+# carries the CLI's exit code, so every failed run is retried.
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+
+def normalize_python_source(source: bytes) -> bytes:
+    """
+    Return a canonical form of Python source for cache lookups.
+
+    Round-tripping through the AST drops comments and formatting, so files
+    that differ only in those respects share a cache entry. Source that
+    does not parse is returned unchanged.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return source
+    return ast.unparse(tree).encode()
+
+
+class ResponseCache:
+    """File-backed cache of generated test code keyed by source hash."""
+
+    def __init__(self, cache_dir: str):
+        """
+        Initialize the response cache.
+
+        Args:
+            cache_dir: Directory where cached test files are stored.
+        """
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def key(source: bytes, test_framework: str, module: str) -> str:
+        """
+        Return the cache key for a source file and test framework.
+
+        ``module`` is the source's module name: generated tests import
+        from it, so identical sources in different modules must not share
+        an entry.
+        """
+        digest = hashlib.sha256(source)
+        digest.update(b"\0" + test_framework.encode())
+        digest.update(b"\0" + module.encode())
+        digest.update(b"\0" + PROMPT_VERSION)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached test code for ``key``, or None on a miss."""
+        try:
+            return (self.cache_dir / f"{key}.py").read_text()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, test_code: str) -> None:
+        """Store test code under ``key``, replacing the file atomically."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as tmp_file:
+            tmp_file.write(test_code)
+        os.replace(tmp_path, self.cache_dir / f"{key}.py")
 
 
 class ClaudeTestGenerator:
     """Demo class for generating tests using Claude Code SDK."""
 
-    def __init__(self, cwd: Optional[str] = None, max_turns: int = 10):
+    # Per-file prompts, filled in with str.format. The static instructions
+    # are sent separately as TEST_GENERATION_INSTRUCTIONS.
+    _PROMPT_TEMPLATE = """
+Please analyze the Python file at {path} and generate \
+comprehensive unit tests using {framework}.
+
+Create a test file named {test_file} with the generated test code.
+"""
+
+    # With inline_source the file contents come first, so files with a
+    # common header share a longer prompt prefix.
+    _INLINE_PROMPT_TEMPLATE = """
+Here is a Python file:
+
+```python
+{source}
+```
+
+It is located at {path}. Please generate comprehensive unit \
+tests for it using {framework}.
+
+Create a test file named {test_file} with the generated test code.
+"""
+
+    def __init__(
+        self,
+        cwd: Optional[str] = None,
+        max_turns: int = 10,
+        cache_dir: Optional[str] = None,
+        normalize_source: bool = False,
+        inline_source: bool = False,
+    ):
         """
         Initialize the Claude test generator.
 
@@ -25,26 +190,50 @@ class ClaudeTestGenerator:
             cwd: Working directory for Claude Code operations. Defaults to
                 current directory.
             max_turns: Maximum number of turns for conversation with Claude.
+            cache_dir: Directory for caching generated tests by source
+                content (e.g. DEFAULT_CACHE_DIR). Caching is disabled when
+                None.
+            normalize_source: Key the cache on the normalized AST of the
+                source instead of its raw bytes, so comment and formatting
+                changes still hit the cache.
+            inline_source: Embed the source file in the prompt instead of
+                having Claude read it with the Read tool, saving a turn per
+                file.
         """
         self.cwd = Path(cwd) if cwd else Path.cwd()
         self.max_turns = max_turns
-        self.options = ClaudeCodeOptions(
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.normalize_source = normalize_source
+        self.inline_source = inline_source
+        _load_env()
+        self.options = _sdk("ClaudeCodeOptions")(
             max_turns=self.max_turns,
             cwd=self.cwd,
-            allowed_tools=["Read", "Write"],
-            permission_mode="acceptEdits"
+            allowed_tools=["Write"] if inline_source else ["Read", "Write"],
+            permission_mode="acceptEdits",
+            append_system_prompt=TEST_GENERATION_INSTRUCTIONS
         )
 
     def analyze_python_file(self, file_path: str) -> str:
-        """Read and return the contents of a Python file."""
-        path = Path(file_path)
-        if not path.exists():
-            raise FileNotFoundError(f"File not found: {file_path}")
+        """
+        Read and return the contents of a Python file.
 
-        return path.read_text()
+        This is the single place source files are read, including by
+        generate_tests when it needs the source.
+        """
+        try:
+            return Path(file_path).read_text()
+        except OSError as e:
+            # A name too long for the filesystem can't exist either
+            if e.errno not in (errno.ENOENT, errno.ENAMETOOLONG):
+                raise
+            raise FileNotFoundError(f"File not found: {file_path}") from None
 
     async def generate_tests(
-        self, python_file_path: str, test_framework: str = "pytest"
+        self,
+        python_file_path: str,
+        test_framework: str = "pytest",
+        dest: Optional[str] = None,
     ) -> str:
         """
         Generate tests for a Python file using Claude.
@@ -52,107 +241,351 @@ class ClaudeTestGenerator:
         Args:
             python_file_path: Path to the Python file to generate tests for
             test_framework: Testing framework to use (pytest, unittest, etc.)
+            dest: Path Claude should write the test file to. Defaults to
+                test_<name>.py in the working directory.
 
         Returns:
             Generated test code as a string
         """
-        # Create the prompt for Claude
-        test_file_name = f"test_{Path(python_file_path).stem}.py"
-        prompt = f"""
-Please analyze the Python file at {python_file_path} and generate \
-comprehensive unit tests using {test_framework}.
-
-Please generate tests that:
-1. Cover all functions and methods
-2. Test edge cases and error conditions
-3. Use appropriate assertions
-4. Follow {test_framework} best practices
-5. Include proper imports and setup
+        # Claude resolves relative paths against cwd, so read, size and
+        # name the source the same way.
+        source_file = str(self.cwd / python_file_path)
 
-Create a test file named {test_file_name} with the generated test code.
-"""
+        if dest:
+            test_file = os.path.abspath(dest)
+            test_file_path = anyio.Path(test_file)
+        else:
+            test_file = _test_file_name(python_file_path)
+            test_file_path = anyio.Path(self.cwd / test_file)
+
+        source = None
+        if self.cache or self.inline_source:
+            source = await anyio.to_thread.run_sync(
+                self.analyze_python_file, source_file
+            )
+
+        # Unchanged sources are served from the response cache
+        cache_key = None
+        if self.cache:
+            source_bytes = source.encode()
+            if self.normalize_source:
+                source_bytes = normalize_python_source(source_bytes)
+            cache_key = self.cache.key(
+                source_bytes, test_framework, _module_name(python_file_path)
+            )
+            cached_code = await anyio.to_thread.run_sync(
+                self.cache.get, cache_key
+            )
+            if cached_code is not None:
+                await test_file_path.write_text(cached_code)
+                return cached_code
+
+        # Create the prompt for Claude. Only the per-file details go here;
+        # the static instructions live in the system prompt.
+        template = (self._INLINE_PROMPT_TEMPLATE if self.inline_source
+                    else self._PROMPT_TEMPLATE)
+        prompt = template.format(
+            path=source_file,
+            framework=test_framework,
+            test_file=test_file,
+            source=source,
+        )
 
-        # Send request to Claude Code SDK
-        messages = []
-        async for message in query(prompt=prompt, options=self.options):
-            messages.append(message)
+        # Small files need only a few turns; don't give Claude room to
+        # wander. Only max_turns changes, so the prompt prefix is unaffected.
+        options = self.options
+        if dest:
+            # acceptEdits only auto-approves writes inside the working
+            # directories, and dest may lie outside cwd.
+            options = dataclasses.replace(
+                options,
+                add_dirs=[*options.add_dirs, os.path.dirname(test_file)],
+            )
+        if source is not None:
+            size = len(source)
+        else:
+            # If the source can't be found, leave the budget to max_turns.
+            try:
+                size = (await anyio.Path(source_file).stat()).st_size
+            except OSError:
+                size = None
+        if size is not None:
+            max_turns = min(self.max_turns,
+                            max(MIN_TURNS, size // BYTES_PER_TURN))
+            if max_turns != options.max_turns:
+                options = dataclasses.replace(options, max_turns=max_turns)
+
+        # Send request to Claude Code SDK. Claude writes the test file with
+        # the Write tool, so the messages themselves are not needed; drain
+        # the stream without holding on to them.
+        query = _sdk("query")
+        async for _message in query(prompt=prompt, options=options):
+            pass
 
         # The test file should have been created by Claude via the Write tool
         # Let's check if it exists and read it
-        test_file_path = Path(f"test_{Path(python_file_path).stem}.py")
-
-        if test_file_path.exists():
-            test_code = test_file_path.read_text()
+        if await test_file_path.exists():
+            test_code = await test_file_path.read_text()
+            if cache_key and test_code:
+                await anyio.to_thread.run_sync(
+                    self.cache.set, cache_key, test_code
+                )
             return test_code
         else:
             return ""
 
     async def generate_tests_for_directory(
-        self, directory_path: str, output_dir: str = "tests"
+        self,
+        directory_path: str,
+        output_dir: str = "tests",
+        max_parallel: int = 4,
+        skip_unchanged: bool = False,
+        max_retries: int = 4,
     ) -> List[str]:
         """
         Generate tests for all Python files in a directory.
 
+        Files are processed concurrently, with at most ``max_parallel``
+        requests to Claude in flight at once.
+
         Args:
             directory_path: Path to directory containing Python files
             output_dir: Directory to save generated tests
+            max_parallel: Maximum number of files to process concurrently
+            skip_unchanged: Skip files whose source has not changed since
+                their tests were last generated into ``output_dir``
+            max_retries: Number of times to retry a file whose Claude Code
+                run failed, backing off exponentially between attempts
 
         Returns:
             List of generated test file paths
         """
         directory = Path(directory_path)
-        if not directory.exists():
+        if not await anyio.Path(directory).exists():
             raise FileNotFoundError(f"Directory not found: {directory_path}")
 
-        output_path = Path(output_dir)
-        output_path.mkdir(exist_ok=True)
-
-        generated_files = []
+        output_path = str(Path(output_dir))
+        await anyio.Path(output_path).mkdir(exist_ok=True)
 
-        # Find all Python files
-        for python_file in directory.glob("**/*.py"):
-            # Skip test files and __init__.py
-            if (python_file.name.startswith("test_") or
-                    python_file.name == "__init__.py"):
-                continue
+        # Find all Python files, skipping tests and packaging files
+        python_files = await anyio.to_thread.run_sync(
+            _find_python_files, str(directory)
+        )
 
+        # Sources with the same module name would overwrite each other's
+        # test file, so leave them out rather than guess which one wins.
+        colliding = _colliding_files(python_files)
+        for python_file in python_files:
+            if python_file in colliding:
+                print(f"✗ Skipping {python_file}: another source also maps "
+                      f"to {_test_file_name(python_file)}")
+        python_files = [python_file for python_file in python_files
+                        if python_file not in colliding]
+        if self.inline_source:
+            # Start files with the same header back to back so their
+            # prompts share a cached prefix.
+            await anyio.to_thread.run_sync(
+                functools.partial(python_files.sort, key=_header_key)
+            )
+
+        if skip_unchanged:
+            manifest_path = os.path.join(output_path, MANIFEST_NAME)
+            manifest = await anyio.to_thread.run_sync(
+                _load_manifest, manifest_path
+            )
+            fingerprints = await anyio.to_thread.run_sync(
+                _changed_files, python_files, output_path, manifest
+            )
+            for python_file in python_files:
+                if python_file not in fingerprints:
+                    print(f"Skipping unchanged file: {python_file}")
+            python_files = list(fingerprints)
+
+        # Each file is an independent Claude round-trip, so run them
+        # concurrently; the semaphore keeps us from flooding the API.
+        semaphore = anyio.Semaphore(max_parallel)
+        results: List[Optional[str]] = [None] * len(python_files)
+
+        async with anyio.create_task_group() as task_group:
+            for index, python_file in enumerate(python_files):
+                task_group.start_soon(
+                    self._generate_test_file, python_file, output_path,
+                    semaphore, results, index, max_retries
+                )
+
+        if skip_unchanged:
+            for python_file, test_file in zip(python_files, results):
+                if test_file is not None:
+                    manifest[os.path.abspath(python_file)] = (
+                        fingerprints[python_file]
+                    )
+            await anyio.to_thread.run_sync(
+                _save_manifest, manifest_path, manifest
+            )
+
+        return [test_file for test_file in results if test_file is not None]
+
+    async def _generate_test_file(
+        self,
+        python_file: str,
+        output_path: str,
+        semaphore: anyio.Semaphore,
+        results: List[Optional[str]],
+        index: int,
+        max_retries: int,
+    ) -> None:
+        """Generate and write the test file for a single Python file."""
+        async with semaphore:
             print(f"Generating tests for: {python_file}")
 
             try:
-                # Generate tests
-                test_code = await self.generate_tests(str(python_file))
-
-                # Create output file name
-                test_file_name = f"test_{python_file.stem}.py"
-                test_file_path = output_path / test_file_name
-
-                # Write test file
-                test_file_path.write_text(test_code)
-                generated_files.append(str(test_file_path))
+                # Have Claude write the test file straight to the output
+                # directory
+                test_file_path = os.path.join(
+                    output_path, _test_file_name(python_file)
+                )
+                for attempt in range(max_retries + 1):
+                    try:
+                        test_code = await self.generate_tests(
+                            python_file, dest=test_file_path
+                        )
+                        break
+                    except _sdk("ProcessError") as e:
+                        if attempt == max_retries:
+                            raise
+                        delay = min(RETRY_MAX_DELAY,
+                                    RETRY_BASE_DELAY * 2 ** attempt)
+                        print(f"Retrying {python_file} in {delay:g}s: {e}")
+                        await anyio.sleep(delay)
+
+                if not test_code:
+                    print(f"✗ No tests generated for {python_file}")
+                    return
+
+                results[index] = test_file_path
 
                 print(f"✓ Generated: {test_file_path}")
 
             except Exception as e:
                 print(f"✗ Error generating tests for {python_file}: {e}")
 
-        return generated_files
 
+def _find_python_files(directory: str) -> List[str]:
+    """
+    Return the Python files under ``directory`` that need tests.
+
+    Walks the tree with ``os.scandir`` so each entry's type comes from the
+    cached directory listing instead of an extra ``stat`` call, and skips
+    files matching SKIP_FILE_NAMES or SKIP_FILE_PREFIXES.
+    """
+    python_files = []
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                name = entry.name
+                if (name.endswith(".py") and
+                        name not in SKIP_FILE_NAMES and
+                        not name.startswith(SKIP_FILE_PREFIXES)):
+                    python_files.append(entry.path)
+    return python_files
+
+
+def _module_name(python_file_path: str) -> str:
+    """Return the module name of a Python file, e.g. foo for src/foo.py."""
+    return os.path.splitext(os.path.basename(python_file_path))[0]
+
+
+def _test_file_name(python_file_path: str) -> str:
+    """Return the test file name for a Python file, e.g. test_foo.py."""
+    return "test_" + _module_name(python_file_path) + ".py"
+
+
+def _colliding_files(python_files: List[str]) -> set:
+    """Return the files whose test file name another file also maps to."""
+    by_test_file: Dict[str, List[str]] = {}
+    for python_file in python_files:
+        by_test_file.setdefault(_test_file_name(python_file), []).append(
+            python_file
+        )
+    return {python_file
+            for group in by_test_file.values() if len(group) > 1
+            for python_file in group}
 
-async def demo_interactive():
-    """Interactive demo function for use in Python REPL."""
-    print("Claude Test Generator Demo")
-    print("=" * 30)
 
+def _load_manifest(manifest_path: str) -> Dict[str, dict]:
+    """Load an output directory manifest, or return an empty one."""
     try:
-        generator = ClaudeTestGenerator()
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest_path: str, manifest: Dict[str, dict]) -> None:
+    """Write an output directory manifest atomically."""
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _changed_files(
+    python_files: List[str], output_path: str, manifest: Dict[str, dict]
+) -> Dict[str, dict]:
+    """
+    Return fingerprints for the files whose tests need regenerating.
+
+    A file is unchanged when its manifest entry matches and its test file
+    still exists. Matching mtime and size is trusted without reading the
+    file; otherwise the content hash decides, and entries for files that
+    were only touched are refreshed in ``manifest``.
+    """
+    changed = {}
+    for python_file in python_files:
+        st = os.stat(python_file)
+        fingerprint = {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+        key = os.path.abspath(python_file)
+        entry = manifest.get(key)
+        test_file_path = os.path.join(
+            output_path, _test_file_name(python_file)
+        )
+        if entry and os.path.exists(test_file_path):
+            if (entry["mtime_ns"], entry["size"]) == (
+                    fingerprint["mtime_ns"], fingerprint["size"]):
+                continue
+            fingerprint["sha256"] = _file_sha256(python_file)
+            if entry["sha256"] == fingerprint["sha256"]:
+                manifest[key] = fingerprint
+                continue
+        else:
+            fingerprint["sha256"] = _file_sha256(python_file)
+        changed[python_file] = fingerprint
+    return changed
 
-        # Get file path from user
-        file_path = input("Enter path to Python file: ").strip()
 
-        if not file_path:
-            print("Using demo example...")
-            # Create a simple demo file
-            demo_code = '''def add(a, b):
+def _file_sha256(path: str) -> str:
+    """Return the hex SHA-256 digest of a file's contents."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _header_key(python_file: str) -> bytes:
+    """
+    Return a file's first kilobyte as a sort key.
+
+    Sorting on the raw bytes puts files with a common prefix next to each
+    other, not just files whose first kilobyte is identical.
+    """
+    with open(python_file, "rb") as f:
+        return f.read(1024)
+
+
+# Source written to demo_calculator.py when the demo is run without a file
+DEMO_CODE = '''def add(a, b):
     """Add two numbers."""
     return a + b
 
@@ -181,11 +614,29 @@ class Calculator:
         return result
 '''
 
-            # Write demo file
-            demo_file = Path("demo_calculator.py")
-            demo_file.write_text(demo_code)
+
+async def demo_interactive():
+    """Interactive demo function for use in Python REPL."""
+    print("Claude Test Generator Demo")
+    print("=" * 30)
+
+    try:
+        generator = ClaudeTestGenerator()
+
+        # Get file path from user
+        file_path = input("Enter path to Python file: ").strip()
+
+        if not file_path:
+            print("Using demo example...")
+            # Write the demo file, unless an identical copy already exists
+            demo_file = anyio.Path("demo_calculator.py")
             file_path = str(demo_file)
-            print(f"Created demo file: {file_path}")
+            if (await demo_file.exists() and
+                    await demo_file.read_text() == DEMO_CODE):
+                print(f"Using existing demo file: {file_path}")
+            else:
+                await demo_file.write_text(DEMO_CODE)
+                print(f"Created demo file: {file_path}")
 
         # Generate tests
         print("\\nGenerating tests...")
@@ -197,8 +648,8 @@ class Calculator:
         print(test_code)
 
         # Save to file
-        test_file = Path(f"test_{Path(file_path).stem}.py")
-        test_file.write_text(test_code)
+        test_file = Path(_test_file_name(file_path))
+        await anyio.Path(test_file).write_text(test_code)
         print(f"\\nTests saved to: {test_file}")
 
     except Exception as e:
@@ -207,5 +658,26 @@ class Calculator:
               "npm install -g @anthropic-ai/claude-code")
 
 
+def run(async_fn, *args):
+    """
+    Run an async function with anyio, on uvloop when it is installed.
+
+    uvloop is an optional dependency (``pip install .[uvloop]``); without it
+    the default asyncio event loop is used.
+    """
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        backend_options = {}
+    else:
+        backend_options = {"use_uvloop": True}
+    return anyio.run(async_fn, *args, backend_options=backend_options)
+
+
+def main():
+    """Entry point for the ``claude-test-generator`` console script."""
+    run(demo_interactive)
+
+
 if __name__ == "__main__":
-    anyio.run(demo_interactive)
+    main()
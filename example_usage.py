@@ -3,16 +3,13 @@
 Example usage of the Claude Test Generator with Claude Code SDK.
 """
 
-import anyio
 from pathlib import Path
-from claude_test_generator import ClaudeTestGenerator
+from claude_test_generator import ClaudeTestGenerator, run
 
 
 # Example 1: Generate tests for a single file
-async def example_single_file():
+async def example_single_file(generator: ClaudeTestGenerator):
     """Example of generating tests for a single Python file."""
-    generator = ClaudeTestGenerator()
-
     # Use the demo_calculator.py file as an example
     file_path = "demo_calculator.py"
 
@@ -31,10 +28,8 @@ async def example_single_file():
 
 
 # Example 2: Generate tests for an entire directory
-async def example_directory():
+async def example_directory(generator: ClaudeTestGenerator):
     """Example of generating tests for all Python files in a directory."""
-    generator = ClaudeTestGenerator()
-
     # Create a temporary directory with Python files for demonstration
     test_dir = Path("example_project")
     test_dir.mkdir(exist_ok=True)
@@ -113,10 +108,8 @@ async def example_custom_config():
 
 
 # Example 5: Working with existing files
-async def example_existing_files():
+async def example_existing_files(generator: ClaudeTestGenerator):
     """Example using the actual files in this project."""
-    generator = ClaudeTestGenerator()
-
     # Generate tests for the main module
     try:
         print("Generating tests for claude_test_generator.py...")
@@ -144,17 +137,21 @@ async def example_existing_files():
 
 async def main():
     """Run all examples."""
+    # Share one generator so later examples reuse its configuration and
+    # Claude's warm prompt cache.
+    generator = ClaudeTestGenerator()
+
     print("=" * 60)
     print("Claude Test Generator - Example Usage")
     print("=" * 60)
 
     print("\nExample 1: Single file test generation")
     print("-" * 40)
-    await example_single_file()
+    await example_single_file(generator)
 
     print("\nExample 2: Directory test generation")
     print("-" * 40)
-    await example_directory()
+    await example_directory(generator)
 
     print("\nExample 4: Custom configuration")
     print("-" * 40)
@@ -162,7 +159,7 @@ async def main():
 
     print("\nExample 5: Working with existing files")
     print("-" * 40)
-    await example_existing_files()
+    await example_existing_files(generator)
 
 
 if __name__ == "__main__":
@@ -177,8 +174,9 @@ if __name__ == "__main__":
     print("  python claude_test_generator.py")
     print("\nTo run individual examples in Python REPL:")
     print("  >>> import anyio")
+    print("  >>> from claude_test_generator import ClaudeTestGenerator")
     print("  >>> from example_usage import example_single_file")
-    print("  >>> anyio.run(example_single_file)")
+    print("  >>> anyio.run(example_single_file, ClaudeTestGenerator())")
     print("\nRunning all examples now...")
     print("=" * 60)
-    anyio.run(main)
+    run(main)
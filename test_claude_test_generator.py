@@ -4,30 +4,173 @@ Comprehensive unit tests for claude_test_generator.py
 """
 
 import pytest
+import anyio
 import asyncio
+import contextlib
+import copy
+import dataclasses
+import io
+import json
 from pathlib import Path
-from unittest.mock import Mock, AsyncMock, patch, mock_open
-from typing import List
-import tempfile
+from unittest.mock import Mock, AsyncMock
 import os
-import shutil
+import re
+import runpy
+import sys
+
+import claude_test_generator
+from claude_test_generator import (
+    ClaudeTestGenerator,
+    DEMO_CODE,
+    ResponseCache,
+    TEST_GENERATION_INSTRUCTIONS,
+    demo_interactive,
+    main,
+    normalize_python_source,
+    run,
+)
 
-from claude_test_generator import ClaudeTestGenerator, demo_interactive
+
+SAMPLE_SRC = b"def f():\n    pass\n"
+EXPECTED_TEST = b"# Generated test code\ndef test_example():\n    pass\n"
+# What the stub query writes, and what tests pre-seed into the cache
+GENERATED_TEST = "# Generated test"
+CACHED_TEST = "# cached test"
+
+# Messages yielded by every stubbed ``query`` stream
+_QUERY_MSGS = ("Generated test message",)
+
+# Compiled once and passed to pytest.raises(match=...)
+DIR_NOT_FOUND_RE = re.compile(r"^Directory not found: nonexistent$")
+
+
+@pytest.fixture
+def workdir(tmp_path_factory):
+    """Per-test directory under pytest's shared, session-cleaned temp base."""
+    return tmp_path_factory.mktemp("gen", numbered=True)
+
+
+@pytest.fixture
+def fake_workdir(fs):
+    """Work directory on pyfakefs' in-memory filesystem."""
+    return Path(fs.create_dir("/work").path)
+
+
+@pytest.fixture(scope="module")
+def cwd():
+    """The process working directory, looked up once per module."""
+    return Path.cwd()
+
+
+@pytest.fixture(scope="module")
+def default_generator():
+    """A default ClaudeTestGenerator shared by tests that don't modify it."""
+    return ClaudeTestGenerator()
+
+
+@pytest.fixture
+def mock_query(monkeypatch):
+    """Patch ``query`` with a mock that yields a fresh message stream per call."""
+    mock = Mock(side_effect=lambda *args, **kwargs: _async_iter(_QUERY_MSGS))
+    monkeypatch.setattr("claude_test_generator.query", mock)
+    return mock
+
+
+@pytest.fixture
+def mock_sleep(monkeypatch):
+    """Patch ``anyio.sleep`` so retry backoff doesn't actually wait."""
+    mock = AsyncMock()
+    monkeypatch.setattr("claude_test_generator.anyio.sleep", mock)
+    return mock
+
+
+@pytest.fixture
+def make_generator(default_generator):
+    """Return a factory for copies of the default generator with a new cwd."""
+    def make(cwd):
+        generator = copy.copy(default_generator)
+        generator.cwd = Path(cwd)
+        generator.options = dataclasses.replace(
+            default_generator.options, cwd=generator.cwd
+        )
+        return generator
+    return make
+
+
+def seed_dir(root, files):
+    """Create ``root`` and write each ``{relative path: bytes}`` entry under it."""
+    root.mkdir(parents=True, exist_ok=True)
+    for name, content in files.items():
+        path = root / name
+        if path.parent != root:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return root
+
+
+async def _async_iter(items):
+    """Mimic the async message stream returned by ``query``."""
+    for item in items:
+        yield item
+
+
+def _completed(result):
+    """Return an already-resolved future; awaiting it just yields ``result``."""
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(result)
+    return future
+
+
+def _cli_failure():
+    """Return the ProcessError the SDK raises when the Claude CLI exits non-zero."""
+    return claude_test_generator.ProcessError(
+        "Command failed with exit code 1",
+        exit_code=1,
+        stderr="Check stderr output for details",
+    )
+
+
+def _query_writing(test_code):
+    """Return a ``query`` stand-in that writes the test file like Claude."""
+    def fake_query(*, prompt, options):
+        test_file = re.search(r"Create a test file named (\S+)", prompt).group(1)
+        (Path(options.cwd) / test_file).write_text(test_code)
+        return _async_iter(_QUERY_MSGS)
+    return fake_query
+
+
+# scenario -> (source files, output_dir argument, query error, expected result)
+DIRECTORY_SCENARIOS = {
+    "success": (
+        ("module1.py", "module2.py"), None, None,
+        ["tests/test_module1.py", "tests/test_module2.py"],
+    ),
+    "custom_output": (
+        ("module1.py",), "custom_tests", None, ["custom_tests/test_module1.py"],
+    ),
+    "skip_tests": (
+        ("module1.py", "test_existing.py", "__init__.py", "conftest.py", "setup.py"),
+        None, None, ["tests/test_module1.py"],
+    ),
+    "errors": (("module1.py",), None, Exception("Test error"), []),
+    "empty": ((), None, None, []),
+}
 
 
 class TestClaudeTestGenerator:
     """Test cases for ClaudeTestGenerator class."""
 
-    def test_init_default_values(self):
+    def test_init_default_values(self, default_generator, cwd):
         """Test initialization with default values."""
-        generator = ClaudeTestGenerator()
+        generator = default_generator
         
-        assert generator.cwd == Path.cwd()
+        assert generator.cwd == cwd
         assert generator.max_turns == 10
         assert generator.options.max_turns == 10
-        assert generator.options.cwd == Path.cwd()
+        assert generator.options.cwd == cwd
         assert generator.options.allowed_tools == ["Read", "Write"]
         assert generator.options.permission_mode == "acceptEdits"
+        assert generator.options.append_system_prompt == TEST_GENERATION_INSTRUCTIONS
 
     def test_init_custom_values(self):
         """Test initialization with custom values."""
@@ -41,373 +184,693 @@ class TestClaudeTestGenerator:
         assert generator.options.max_turns == test_max_turns
         assert generator.options.cwd == Path(test_cwd)
 
-    def test_init_none_cwd(self):
+    def test_init_inline_source(self):
+        """Test that inline_source drops the Read tool."""
+        generator = ClaudeTestGenerator(inline_source=True)
+        
+        assert generator.inline_source is True
+        assert generator.options.allowed_tools == ["Write"]
+
+    def test_init_none_cwd(self, cwd):
         """Test initialization with None cwd."""
         generator = ClaudeTestGenerator(cwd=None)
         
-        assert generator.cwd == Path.cwd()
+        assert generator.cwd == cwd
 
-    def test_analyze_python_file_success(self):
+    def test_analyze_python_file_success(self, default_generator, fs):
         """Test successful file analysis."""
-        test_content = "def test_function():\n    pass\n"
-        
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            f.write(test_content)
-            f.flush()
-            
-            generator = ClaudeTestGenerator()
-            result = generator.analyze_python_file(f.name)
-            
-            assert result == test_content
-            
-        os.unlink(f.name)
-
-    def test_analyze_python_file_not_found(self):
-        """Test file analysis with non-existent file."""
-        generator = ClaudeTestGenerator()
-        
-        with pytest.raises(FileNotFoundError, match="File not found: nonexistent.py"):
-            generator.analyze_python_file("nonexistent.py")
-
-    def test_analyze_python_file_empty_file(self):
+        test_content = b"def test_function():\n    pass\n"
+        fs.create_file("/f.py", contents=test_content)
+        
+        assert default_generator.analyze_python_file("/f.py") == test_content.decode()
+
+    @pytest.mark.parametrize(
+        "path", ["nonexistent.py", "a" * 300 + ".py", "/no/such/dir/x.py"]
+    )
+    def test_analyze_python_file_not_found(self, default_generator, path):
+        """Test file analysis with missing, overlong and unreachable paths."""
+        not_found = re.compile(f"^File not found: {re.escape(path)}$")
+        with pytest.raises(FileNotFoundError, match=not_found):
+            default_generator.analyze_python_file(path)
+
+    def test_analyze_python_file_empty_file(self, default_generator, fs):
         """Test file analysis with empty file."""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            f.write("")
-            f.flush()
-            
-            generator = ClaudeTestGenerator()
-            result = generator.analyze_python_file(f.name)
-            
-            assert result == ""
-            
-        os.unlink(f.name)
+        fs.create_file("/f.py")
+        
+        assert default_generator.analyze_python_file("/f.py") == ""
 
     @pytest.mark.asyncio
-    @patch('claude_test_generator.query')
-    async def test_generate_tests_success(self, mock_query):
+    async def test_generate_tests_success(self, workdir, make_generator, mock_query):
         """Test successful test generation."""
-        mock_query.return_value = iter(["Generated test message"])
-        test_code = "# Generated test code\ndef test_example():\n    pass\n"
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Create source file
-            source_file = Path(temp_dir) / "example.py"
-            source_file.write_text("def example():\n    pass\n")
-            
-            # Create expected test file
-            test_file = Path(temp_dir) / "test_example.py"
-            test_file.write_text(test_code)
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
-            result = await generator.generate_tests(str(source_file))
-            
-            assert result == test_code
-            mock_query.assert_called_once()
+        # Create source file
+        source_file = workdir / "example.py"
+        source_file.write_bytes(SAMPLE_SRC)
+        
+        # Create expected test file
+        test_file = workdir / "test_example.py"
+        test_file.write_bytes(EXPECTED_TEST)
+        
+        generator = make_generator(workdir)
+        result = await generator.generate_tests(str(source_file))
+        
+        assert result == EXPECTED_TEST.decode()
+        mock_query.assert_called_once()
 
     @pytest.mark.asyncio
-    @patch('claude_test_generator.query')
-    async def test_generate_tests_no_output_file(self, mock_query):
+    async def test_generate_tests_no_output_file(self, workdir, make_generator, mock_query):
         """Test test generation when no output file is created."""
-        mock_query.return_value = iter(["Generated test message"])
         
-        with tempfile.TemporaryDirectory() as temp_dir:
-            source_file = Path(temp_dir) / "example.py"
-            source_file.write_text("def example():\n    pass\n")
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
-            result = await generator.generate_tests(str(source_file))
-            
-            assert result == ""
+        source_file = workdir / "example.py"
+        source_file.write_bytes(SAMPLE_SRC)
+        
+        generator = make_generator(workdir)
+        result = await generator.generate_tests(str(source_file))
+        
+        assert result == ""
 
     @pytest.mark.asyncio
-    @patch('claude_test_generator.query')
-    async def test_generate_tests_custom_framework(self, mock_query):
+    async def test_generate_tests_custom_framework(self, workdir, make_generator, mock_query):
         """Test test generation with custom framework."""
-        mock_query.return_value = iter(["Generated test message"])
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            source_file = Path(temp_dir) / "example.py"
-            source_file.write_text("def example():\n    pass\n")
-            
-            test_file = Path(temp_dir) / "test_example.py"
-            test_file.write_text("# unittest test")
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
-            result = await generator.generate_tests(str(source_file), "unittest")
-            
-            assert result == "# unittest test"
-            
-            # Check that the prompt includes the custom framework
-            call_args = mock_query.call_args
-            assert "unittest" in call_args[1]['prompt']
+        
+        source_file = workdir / "example.py"
+        source_file.write_bytes(SAMPLE_SRC)
+        
+        test_file = workdir / "test_example.py"
+        test_file.write_bytes(b"# unittest test")
+        
+        generator = make_generator(workdir)
+        result = await generator.generate_tests(str(source_file), "unittest")
+        
+        assert result == "# unittest test"
+        
+        # Check that the prompt includes the custom framework
+        call_args = mock_query.call_args
+        assert "unittest" in call_args[1]['prompt']
 
     @pytest.mark.asyncio
-    @patch('claude_test_generator.query')
-    async def test_generate_tests_for_directory_success(self, mock_query):
-        """Test successful test generation for directory."""
-        mock_query.return_value = iter(["Generated test message"])
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Create source files
-            source_dir = Path(temp_dir) / "src"
-            source_dir.mkdir()
-            
-            file1 = source_dir / "module1.py"
-            file1.write_text("def func1():\n    pass\n")
-            
-            file2 = source_dir / "module2.py"
-            file2.write_text("def func2():\n    pass\n")
-            
-            # Create test files that would be generated
-            test1 = Path(temp_dir) / "test_module1.py"
-            test1.write_text("# Test for module1")
-            
-            test2 = Path(temp_dir) / "test_module2.py"
-            test2.write_text("# Test for module2")
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
-            result = await generator.generate_tests_for_directory(str(source_dir))
-            
-            assert len(result) == 2
-            assert "tests/test_module1.py" in result
-            assert "tests/test_module2.py" in result
+    async def test_generate_tests_prompt_excludes_static_instructions(self, workdir, make_generator, mock_query):
+        """Test that the static instructions are sent via the system prompt."""
+        
+        source_file = workdir / "example.py"
+        source_file.write_bytes(SAMPLE_SRC)
+        
+        generator = make_generator(workdir)
+        await generator.generate_tests(str(source_file))
+        
+        call_args = mock_query.call_args
+        assert "Cover all functions and methods" not in call_args[1]['prompt']
+        assert str(source_file) in call_args[1]['prompt']
+        assert call_args[1]['options'].append_system_prompt == TEST_GENERATION_INSTRUCTIONS
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("size, max_turns, expected_turns", [
+        (100, 10, 3),
+        (20_000, 10, 5),
+        (200_000, 10, 10),
+        (100, 2, 2),
+    ])
+    async def test_generate_tests_scales_max_turns(
+        self, size, max_turns, expected_turns, workdir, mock_query
+    ):
+        """Test that the turn budget scales with the source file size."""
+        
+        source_file = workdir / "example.py"
+        source_file.write_bytes(b"#" * size)
+        
+        generator = ClaudeTestGenerator(cwd=str(workdir), max_turns=max_turns)
+        await generator.generate_tests(str(source_file))
+        
+        assert mock_query.call_args[1]['options'].max_turns == expected_turns
+        assert generator.options.max_turns == max_turns
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_sizes_relative_path_against_cwd(
+        self, workdir, mock_query, monkeypatch, tmp_path
+    ):
+        """Test that relative paths are sized the way Claude resolves them."""
+        monkeypatch.chdir(tmp_path)
+        seed_dir(workdir / "src", {"foo.py": b"#" * 20_000})
+        
+        generator = ClaudeTestGenerator(cwd=str(workdir))
+        await generator.generate_tests("src/foo.py")
+        
+        assert mock_query.call_args[1]['options'].max_turns == 5
 
     @pytest.mark.asyncio
-    async def test_generate_tests_for_directory_not_found(self):
+    async def test_generate_tests_unsized_path_keeps_max_turns(
+        self, workdir, mock_query
+    ):
+        """Test that a path that can't be sized falls back to max_turns."""
+        generator = ClaudeTestGenerator(cwd=str(workdir))
+        await generator.generate_tests("missing.py")
+        
+        assert mock_query.call_args[1]['options'].max_turns == 10
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_inline_source(self, workdir, mock_query):
+        """Test that inline_source embeds the file contents in the prompt."""
+        
+        source_file = workdir / "example.py"
+        source_file.write_bytes(b"def example():\n    return 42\n")
+        
+        generator = ClaudeTestGenerator(cwd=str(workdir), inline_source=True)
+        await generator.generate_tests(str(source_file))
+        
+        prompt = mock_query.call_args[1]['prompt']
+        assert "def example():\n    return 42\n" in prompt
+        assert prompt.index("return 42") < prompt.index(str(source_file))
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mode", ["inline_source", "cache_dir"])
+    async def test_generate_tests_reads_relative_path_against_cwd(
+        self, mode, workdir, mock_query, monkeypatch, tmp_path
+    ):
+        """Test that relative paths are read the way Claude resolves them."""
+        mock_query.side_effect = _query_writing(GENERATED_TEST)
+        monkeypatch.chdir(tmp_path)
+        seed_dir(workdir / "src", {"foo.py": SAMPLE_SRC})
+        
+        option = (True if mode == "inline_source"
+                  else str(workdir / "cache"))
+        generator = ClaudeTestGenerator(cwd=str(workdir), **{mode: option})
+        result = await generator.generate_tests("src/foo.py")
+        
+        assert result == GENERATED_TEST
+        assert str(workdir / "src" / "foo.py") in mock_query.call_args[1]['prompt']
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_with_dest(self, workdir, make_generator, mock_query):
+        """Test that Claude is asked to write the test file to dest."""
+        mock_query.side_effect = _query_writing(GENERATED_TEST)
+        
+        source_file = workdir / "example.py"
+        source_file.write_bytes(SAMPLE_SRC)
+        dest = workdir / "out" / "test_example.py"
+        dest.parent.mkdir()
+        
+        generator = make_generator(workdir)
+        result = await generator.generate_tests(str(source_file), dest=str(dest))
+        
+        assert result == GENERATED_TEST
+        assert dest.read_text() == GENERATED_TEST
+        assert str(dest) in mock_query.call_args[1]['prompt']
+        assert not (workdir / "test_example.py").exists()
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_cache_hit_skips_query(self, workdir, mock_query):
+        """Test that a cached response is returned without calling Claude."""
+        source_file = workdir / "example.py"
+        source_file.write_bytes(SAMPLE_SRC)
+        
+        cache_dir = workdir / "cache"
+        cache = ResponseCache(str(cache_dir))
+        key = cache.key(source_file.read_bytes(), "pytest", "example")
+        cache.set(key, CACHED_TEST)
+        
+        generator = ClaudeTestGenerator(cwd=str(workdir), cache_dir=str(cache_dir))
+        result = await generator.generate_tests(str(source_file))
+        
+        assert result == CACHED_TEST
+        assert (workdir / "test_example.py").read_text() == CACHED_TEST
+        mock_query.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_cache_is_per_module(self, workdir, mock_query):
+        """Test that identical sources in different modules don't share tests."""
+        mock_query.side_effect = _query_writing(GENERATED_TEST)
+        seed_dir(workdir / "a", {"alpha.py": SAMPLE_SRC, "beta.py": SAMPLE_SRC})
+        
+        generator = ClaudeTestGenerator(
+            cwd=str(workdir), cache_dir=str(workdir / "cache")
+        )
+        await generator.generate_tests(str(workdir / "a" / "alpha.py"))
+        await generator.generate_tests(str(workdir / "a" / "beta.py"))
+        
+        assert mock_query.call_count == 2
+        assert (workdir / "test_beta.py").read_text() == GENERATED_TEST
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_normalized_cache_hit(self, workdir, mock_query):
+        """Test that comment-only changes hit the cache when normalizing."""
+        source_file = workdir / "example.py"
+        source_file.write_bytes(b"# A comment\ndef example():\n\n    pass\n")
+        
+        cache_dir = workdir / "cache"
+        cache = ResponseCache(str(cache_dir))
+        key = cache.key(b"def example():\n    pass", "pytest", "example")
+        cache.set(key, CACHED_TEST)
+        
+        generator = ClaudeTestGenerator(
+            cwd=str(workdir), cache_dir=str(cache_dir), normalize_source=True
+        )
+        result = await generator.generate_tests(str(source_file))
+        
+        assert result == CACHED_TEST
+        mock_query.assert_not_called()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("scenario", list(DIRECTORY_SCENARIOS))
+    async def test_generate_tests_for_directory(
+        self, scenario, fake_workdir, monkeypatch, make_generator, mock_query
+    ):
+        """Test directory generation across the common source layouts."""
+        files, output_dir, query_error, expected = DIRECTORY_SCENARIOS[scenario]
+        # The default output directory is relative to the process cwd
+        monkeypatch.chdir(fake_workdir)
+        mock_query.side_effect = query_error or _query_writing(GENERATED_TEST)
+        
+        source_dir = seed_dir(fake_workdir / "src", dict.fromkeys(files, SAMPLE_SRC))
+        
+        generator = make_generator(fake_workdir)
+        args = (str(source_dir), output_dir) if output_dir else (str(source_dir),)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = await generator.generate_tests_for_directory(*args)
+        
+        assert sorted(result) == expected
+        if query_error:
+            assert "✗ Error generating tests for {}: Test error".format(
+                source_dir / files[0]
+            ) in output.getvalue()
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_for_directory_not_found(self, default_generator):
         """Test directory generation with non-existent directory."""
-        generator = ClaudeTestGenerator()
+        generator = default_generator
         
-        with pytest.raises(FileNotFoundError, match="Directory not found: nonexistent"):
+        with pytest.raises(FileNotFoundError, match=DIR_NOT_FOUND_RE):
             await generator.generate_tests_for_directory("nonexistent")
 
     @pytest.mark.asyncio
-    @patch('claude_test_generator.query')
-    async def test_generate_tests_for_directory_custom_output(self, mock_query):
-        """Test directory generation with custom output directory."""
-        mock_query.return_value = iter(["Generated test message"])
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            source_dir = Path(temp_dir) / "src"
-            source_dir.mkdir()
-            
-            file1 = source_dir / "module1.py"
-            file1.write_text("def func1():\n    pass\n")
-            
-            # Create test file that would be generated
-            test1 = Path(temp_dir) / "test_module1.py"
-            test1.write_text("# Test for module1")
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
+    async def test_generate_tests_for_directory_nested_files(self, fake_workdir, make_generator, mock_query):
+        """Test that directory generation finds files in subdirectories."""
+        mock_query.side_effect = _query_writing(GENERATED_TEST)
+        
+        seed_dir(fake_workdir / "src", {
+            "top.py": SAMPLE_SRC,
+            "pkg/sub/deep.py": SAMPLE_SRC,
+            "pkg/sub/test_deep.py": b"# Existing test",
+        })
+        
+        output_dir = fake_workdir / "out"
+        generator = make_generator(fake_workdir)
+        result = await generator.generate_tests_for_directory(
+            str(fake_workdir / "src"), str(output_dir)
+        )
+        
+        assert sorted(result) == [
+            str(output_dir / "test_deep.py"),
+            str(output_dir / "test_top.py"),
+        ]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("max_parallel", [1, 3])
+    async def test_generate_tests_for_directory_limits_concurrency(
+        self, max_parallel, fake_workdir, make_generator, mock_query
+    ):
+        """Test that at most max_parallel Claude runs are in flight at once."""
+        running = peak = 0
+        full = anyio.Event()
+        
+        async def fake_query(*, prompt, options):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            if running == max_parallel:
+                full.set()
+            # Hold the first runs open until the limit is reached, then
+            # give any run the semaphore failed to hold back time to start
+            with anyio.fail_after(5):
+                await full.wait()
+            for _ in range(5):
+                await anyio.sleep(0)
+            running -= 1
+            yield _QUERY_MSGS[0]
+        mock_query.side_effect = fake_query
+        
+        source_dir = seed_dir(fake_workdir / "src", {
+            f"module{i}.py": SAMPLE_SRC for i in range(5)
+        })
+        
+        generator = make_generator(fake_workdir)
+        await generator.generate_tests_for_directory(
+            str(source_dir), str(fake_workdir / "out"), max_parallel=max_parallel
+        )
+        
+        assert mock_query.call_count == 5
+        assert peak == max_parallel
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_for_directory_allows_writes_to_output_dir(
+        self, fake_workdir, make_generator, mock_query
+    ):
+        """Test that Claude may write to an output directory outside cwd."""
+        mock_query.side_effect = _query_writing(GENERATED_TEST)
+        
+        source_dir = seed_dir(fake_workdir / "src", {"module1.py": SAMPLE_SRC})
+        output_dir = Path("/out")
+        
+        generator = make_generator(fake_workdir)
+        result = await generator.generate_tests_for_directory(
+            str(source_dir), str(output_dir)
+        )
+        
+        assert result == [str(output_dir / "test_module1.py")]
+        assert mock_query.call_args[1]['options'].add_dirs == [str(output_dir)]
+        assert generator.options.add_dirs == []
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_for_directory_skips_colliding_names(
+        self, fake_workdir, make_generator, mock_query
+    ):
+        """Test that sources mapping to the same test file are skipped."""
+        mock_query.side_effect = _query_writing(GENERATED_TEST)
+        
+        source_dir = seed_dir(fake_workdir / "src", {
+            "a/utils.py": SAMPLE_SRC,
+            "b/utils.py": SAMPLE_SRC,
+            "top.py": SAMPLE_SRC,
+        })
+        output_dir = fake_workdir / "out"
+        
+        generator = make_generator(fake_workdir)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
             result = await generator.generate_tests_for_directory(
-                str(source_dir), "custom_tests"
+                str(source_dir), str(output_dir), skip_unchanged=True
             )
-            
-            assert len(result) == 1
-            assert "custom_tests/test_module1.py" in result
+        
+        assert result == [str(output_dir / "test_top.py")]
+        assert mock_query.call_count == 1
+        for name in ("a/utils.py", "b/utils.py"):
+            assert "✗ Skipping {}: another source also maps to test_utils.py".format(
+                source_dir / name
+            ) in output.getvalue()
+        manifest = json.loads((output_dir / ".manifest.json").read_text())
+        assert list(manifest) == [os.path.abspath(source_dir / "top.py")]
 
     @pytest.mark.asyncio
-    @patch('claude_test_generator.query')
-    async def test_generate_tests_for_directory_skips_test_files(self, mock_query):
-        """Test that directory generation skips test files and __init__.py."""
-        mock_query.return_value = iter(["Generated test message"])
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            source_dir = Path(temp_dir) / "src"
-            source_dir.mkdir()
-            
-            # Create files that should be processed
-            file1 = source_dir / "module1.py"
-            file1.write_text("def func1():\n    pass\n")
-            
-            # Create files that should be skipped
-            test_file = source_dir / "test_existing.py"
-            test_file.write_text("# Existing test")
-            
-            init_file = source_dir / "__init__.py"
-            init_file.write_text("# Init file")
-            
-            # Create expected test file
-            test1 = Path(temp_dir) / "test_module1.py"
-            test1.write_text("# Test for module1")
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
-            result = await generator.generate_tests_for_directory(str(source_dir))
-            
-            # Should only process module1.py
-            assert len(result) == 1
-            assert "tests/test_module1.py" in result
+    async def test_generate_tests_for_directory_skip_unchanged(self, fake_workdir, make_generator, mock_query):
+        """Test that unchanged files are skipped on the next run."""
+        mock_query.side_effect = _query_writing(GENERATED_TEST)
+        
+        source_dir = seed_dir(fake_workdir / "src", {"module1.py": SAMPLE_SRC})
+        file1 = source_dir / "module1.py"
+        output_dir = str(fake_workdir / "out")
+        
+        generator = make_generator(fake_workdir)
+        first = await generator.generate_tests_for_directory(
+            str(source_dir), output_dir, skip_unchanged=True
+        )
+        second = await generator.generate_tests_for_directory(
+            str(source_dir), output_dir, skip_unchanged=True
+        )
+        
+        assert len(first) == 1
+        assert second == []
+        assert mock_query.call_count == 1
+        assert (Path(output_dir) / ".manifest.json").exists()
+        
+        file1.write_bytes(b"def func1():\n    return 1\n")
+        third = await generator.generate_tests_for_directory(
+            str(source_dir), output_dir, skip_unchanged=True
+        )
+        
+        assert third == first
+        assert mock_query.call_count == 2
 
     @pytest.mark.asyncio
-    @patch('claude_test_generator.query')
-    @patch('builtins.print')
-    async def test_generate_tests_for_directory_with_errors(self, mock_print, mock_query):
-        """Test directory generation with errors in some files."""
-        mock_query.side_effect = Exception("Test error")
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            source_dir = Path(temp_dir) / "src"
-            source_dir.mkdir()
-            
-            file1 = source_dir / "module1.py"
-            file1.write_text("def func1():\n    pass\n")
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
-            result = await generator.generate_tests_for_directory(str(source_dir))
-            
-            assert len(result) == 0
-            mock_print.assert_any_call("✗ Error generating tests for {}: Test error".format(file1))
+    async def test_generate_tests_for_directory_retries_process_errors(
+        self, fake_workdir, make_generator, mock_query, mock_sleep
+    ):
+        """Test that failed Claude Code runs are retried with backoff."""
+        write_tests = _query_writing(GENERATED_TEST)
+        
+        def fake_query(**kwargs):
+            if mock_query.call_count <= 2:
+                raise _cli_failure()
+            return write_tests(**kwargs)
+        mock_query.side_effect = fake_query
+        
+        source_dir = seed_dir(fake_workdir / "src", {"module1.py": SAMPLE_SRC})
+        
+        generator = make_generator(fake_workdir)
+        result = await generator.generate_tests_for_directory(
+            str(source_dir), str(fake_workdir / "out")
+        )
+        
+        assert len(result) == 1
+        assert mock_query.call_count == 3
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [1.0, 2.0]
+
+    @pytest.mark.asyncio
+    async def test_generate_tests_for_directory_gives_up_after_retries(
+        self, fake_workdir, make_generator, mock_query, mock_sleep
+    ):
+        """Test that a file is reported as failed once retries run out."""
+        mock_query.side_effect = _cli_failure()
+        
+        source_dir = seed_dir(fake_workdir / "src", {"module1.py": SAMPLE_SRC})
+        file1 = source_dir / "module1.py"
+        
+        generator = make_generator(fake_workdir)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = await generator.generate_tests_for_directory(
+                str(source_dir), str(fake_workdir / "out"), max_retries=2
+            )
+        
+        assert result == []
+        assert mock_query.call_count == 3
+        assert "✗ Error generating tests for {}: {}".format(
+            file1, mock_query.side_effect
+        ) in output.getvalue()
 
     @pytest.mark.asyncio
-    @patch('claude_test_generator.query')
-    async def test_generate_tests_for_directory_empty_directory(self, mock_query):
-        """Test directory generation with empty directory."""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            source_dir = Path(temp_dir) / "src"
-            source_dir.mkdir()
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
-            result = await generator.generate_tests_for_directory(str(source_dir))
-            
-            assert len(result) == 0
+    async def test_generate_tests_for_directory_fails_fast_on_other_errors(
+        self, fake_workdir, make_generator, mock_query, mock_sleep
+    ):
+        """Test that errors other than a failed Claude Code run are not retried."""
+        mock_query.side_effect = RuntimeError("Test error")
+        
+        source_dir = seed_dir(fake_workdir / "src", {"module1.py": SAMPLE_SRC})
+        
+        generator = make_generator(fake_workdir)
+        result = await generator.generate_tests_for_directory(
+            str(source_dir), str(fake_workdir / "out")
+        )
+        
+        assert result == []
+        assert mock_query.call_count == 1
+        mock_sleep.assert_not_called()
+
+
+class TestResponseCache:
+    """Test cases for ResponseCache class."""
+
+    def test_get_missing_key(self, workdir):
+        """Test that a cache miss returns None."""
+        cache = ResponseCache(str(workdir))
+        
+        assert cache.get("missing") is None
+
+    def test_set_and_get(self, workdir):
+        """Test storing and retrieving test code."""
+        cache = ResponseCache(str(workdir / "nested" / "cache"))
+        cache.set("abc", "# test code")
+        
+        assert cache.get("abc") == "# test code"
+        assert list(cache.cache_dir.iterdir()) == [cache.cache_dir / "abc.py"]
+
+    def test_key_depends_on_source_framework_and_module(self):
+        """Test that the key changes with the source, framework and module."""
+        key = ResponseCache.key(b"def f():\n    pass\n", "pytest", "mod")
+        
+        assert key == ResponseCache.key(b"def f():\n    pass\n", "pytest", "mod")
+        assert key != ResponseCache.key(b"def g():\n    pass\n", "pytest", "mod")
+        assert key != ResponseCache.key(b"def f():\n    pass\n", "unittest", "mod")
+        assert key != ResponseCache.key(b"def f():\n    pass\n", "pytest", "other")
+
+    def test_key_depends_on_prompt_version(self, monkeypatch):
+        """Test that bumping PROMPT_VERSION invalidates existing keys."""
+        key = ResponseCache.key(b"def f():\n    pass\n", "pytest", "mod")
+        monkeypatch.setattr("claude_test_generator.PROMPT_VERSION", b"next")
+        
+        assert key != ResponseCache.key(b"def f():\n    pass\n", "pytest", "mod")
+
+
+class TestNormalizePythonSource:
+    """Test cases for normalize_python_source function."""
+
+    def test_strips_comments_and_whitespace(self):
+        """Test that comments and formatting do not affect the result."""
+        original = b"def f(a, b):\n    return a + b\n"
+        reformatted = b"# helper\ndef f( a,b ):\n\n    return a+b  # sum\n"
+        
+        assert normalize_python_source(original) == normalize_python_source(reformatted)
+
+    def test_keeps_semantic_changes(self):
+        """Test that code changes produce a different result."""
+        assert (normalize_python_source(b"def f():\n    return 1\n") !=
+                normalize_python_source(b"def f():\n    return 2\n"))
+
+    def test_invalid_source_returned_unchanged(self):
+        """Test that unparsable source is returned as-is."""
+        source = b"def broken(:\n"
+        
+        assert normalize_python_source(source) == source
+
+
+class TestRun:
+    """Test cases for run function."""
+
+    def test_run_returns_result(self):
+        """Test that run executes the coroutine function with its arguments."""
+        async def double(value):
+            return value * 2
+        
+        assert run(double, 21) == 42
+
+    def test_run_without_uvloop(self, monkeypatch):
+        """Test that the default event loop is used when uvloop is missing."""
+        async def noop():
+            pass
+        mock_run = Mock()
+        monkeypatch.setattr("claude_test_generator.anyio.run", mock_run)
+        monkeypatch.setitem(sys.modules, "uvloop", None)
+        
+        run(noop)
+        
+        mock_run.assert_called_once_with(noop, backend_options={})
+
+
+class TestMain:
+    """Test cases for the main entry point."""
+
+    def test_main_runs_demo(self, monkeypatch):
+        """Test that main runs the interactive demo."""
+        mock_run = Mock()
+        monkeypatch.setattr("claude_test_generator.run", mock_run)
+        
+        main()
+        
+        mock_run.assert_called_once_with(demo_interactive)
+
+    def test_module_runs_main_as_script(self, monkeypatch):
+        """Test that running the module as a script starts the demo."""
+        mock_run = Mock()
+        monkeypatch.setattr("claude_test_generator.anyio.run", mock_run)
+        monkeypatch.setitem(sys.modules, "uvloop", None)
+        
+        namespace = runpy.run_module("claude_test_generator", run_name="__main__")
+        
+        mock_run.assert_called_once_with(
+            namespace["demo_interactive"], backend_options={}
+        )
 
 
 class TestDemoInteractive:
     """Test cases for demo_interactive function."""
 
+    @pytest.fixture(autouse=True)
+    def _patch_generator(self, monkeypatch):
+        """Replace ClaudeTestGenerator and input(); tests configure the mocks."""
+        self.mock_cls = Mock()
+        self.mock_input = Mock()
+        monkeypatch.setattr("claude_test_generator.ClaudeTestGenerator", self.mock_cls)
+        monkeypatch.setattr("builtins.input", self.mock_input)
+
     @pytest.mark.asyncio
-    @patch('builtins.input')
-    @patch('builtins.print')
-    @patch('claude_test_generator.ClaudeTestGenerator')
-    async def test_demo_interactive_with_file_path(self, mock_generator_class, mock_print, mock_input):
+    async def test_demo_interactive_with_file_path(self, capsys, fake_workdir, monkeypatch):
         """Test demo interactive with user-provided file path."""
-        mock_input.return_value = "test_file.py"
+        self.mock_input.return_value = "test_file.py"
         mock_generator = Mock()
-        mock_generator.generate_tests = AsyncMock(return_value="# Generated test code")
-        mock_generator_class.return_value = mock_generator
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            original_cwd = os.getcwd()
-            try:
-                os.chdir(temp_dir)
-                await demo_interactive()
-                
-                mock_generator.generate_tests.assert_called_once_with("test_file.py")
-                mock_print.assert_any_call("Generated Tests:")
-                
-            finally:
-                os.chdir(original_cwd)
+        mock_generator.generate_tests = Mock(return_value=_completed(EXPECTED_TEST.decode()))
+        self.mock_cls.return_value = mock_generator
+        monkeypatch.chdir(fake_workdir)
+        
+        await demo_interactive()
+        
+        mock_generator.generate_tests.assert_called_once_with("test_file.py")
+        captured = capsys.readouterr()
+        assert "Generated Tests:" in captured.out
 
     @pytest.mark.asyncio
-    @patch('builtins.input')
-    @patch('builtins.print')
-    @patch('claude_test_generator.ClaudeTestGenerator')
-    async def test_demo_interactive_with_empty_input(self, mock_generator_class, mock_print, mock_input):
+    async def test_demo_interactive_with_empty_input(self, capsys, fake_workdir, monkeypatch):
         """Test demo interactive with empty input (uses demo example)."""
-        mock_input.return_value = ""
+        self.mock_input.return_value = ""
+        mock_generator = Mock()
+        mock_generator.generate_tests = Mock(return_value=_completed(EXPECTED_TEST.decode()))
+        self.mock_cls.return_value = mock_generator
+        monkeypatch.chdir(fake_workdir)
+        
+        await demo_interactive()
+        
+        mock_generator.generate_tests.assert_called_once()
+        captured = capsys.readouterr()
+        assert "Using demo example..." in captured.out
+        assert "Created demo file: demo_calculator.py" in captured.out
+
+    @pytest.mark.asyncio
+    async def test_demo_interactive_reuses_existing_demo_file(self, capsys, fake_workdir, monkeypatch):
+        """Test that an identical demo file is not rewritten."""
+        self.mock_input.return_value = ""
         mock_generator = Mock()
-        mock_generator.generate_tests = AsyncMock(return_value="# Generated test code")
-        mock_generator_class.return_value = mock_generator
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            original_cwd = os.getcwd()
-            try:
-                os.chdir(temp_dir)
-                await demo_interactive()
-                
-                mock_generator.generate_tests.assert_called_once()
-                mock_print.assert_any_call("Using demo example...")
-                mock_print.assert_any_call("Created demo file: demo_calculator.py")
-                
-            finally:
-                os.chdir(original_cwd)
+        mock_generator.generate_tests = Mock(return_value=_completed(EXPECTED_TEST.decode()))
+        self.mock_cls.return_value = mock_generator
+        monkeypatch.chdir(fake_workdir)
+        
+        demo_file = Path("demo_calculator.py")
+        demo_file.write_text(DEMO_CODE)
+        os.utime(demo_file, ns=(0, 0))
+        
+        await demo_interactive()
+        
+        assert demo_file.stat().st_mtime_ns == 0
+        captured = capsys.readouterr()
+        assert "Using existing demo file: demo_calculator.py" in captured.out
 
     @pytest.mark.asyncio
-    @patch('builtins.input')
-    @patch('builtins.print')
-    @patch('claude_test_generator.ClaudeTestGenerator')
-    async def test_demo_interactive_with_exception(self, mock_generator_class, mock_print, mock_input):
+    async def test_demo_interactive_with_exception(self, capsys):
         """Test demo interactive with exception handling."""
-        mock_input.return_value = "test_file.py"
-        mock_generator_class.side_effect = Exception("Test error")
+        self.mock_input.return_value = "test_file.py"
+        self.mock_cls.side_effect = Exception("Test error")
         
         await demo_interactive()
         
-        mock_print.assert_any_call("Error: Test error")
-        mock_print.assert_any_call("Make sure you have installed the Claude Code CLI: npm install -g @anthropic-ai/claude-code")
+        captured = capsys.readouterr()
+        assert "Error: Test error" in captured.out
+        assert "Make sure you have installed the Claude Code CLI: npm install -g @anthropic-ai/claude-code" in captured.out
 
     @pytest.mark.asyncio
-    @patch('builtins.input')
-    @patch('builtins.print')
-    @patch('claude_test_generator.ClaudeTestGenerator')
-    async def test_demo_interactive_saves_test_file(self, mock_generator_class, mock_print, mock_input):
+    async def test_demo_interactive_saves_test_file(self, capsys, fake_workdir, monkeypatch):
         """Test that demo interactive saves the test file."""
-        mock_input.return_value = "example.py"
+        self.mock_input.return_value = "example.py"
         mock_generator = Mock()
-        test_code = "# Generated test code\ndef test_example():\n    pass\n"
-        mock_generator.generate_tests = AsyncMock(return_value=test_code)
-        mock_generator_class.return_value = mock_generator
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            original_cwd = os.getcwd()
-            try:
-                os.chdir(temp_dir)
-                await demo_interactive()
-                
-                # Check that test file was created
-                test_file = Path("test_example.py")
-                assert test_file.exists()
-                assert test_file.read_text() == test_code
-                
-                mock_print.assert_any_call("Tests saved to: test_example.py")
-                
-            finally:
-                os.chdir(original_cwd)
+        mock_generator.generate_tests = Mock(return_value=_completed(EXPECTED_TEST.decode()))
+        self.mock_cls.return_value = mock_generator
+        monkeypatch.chdir(fake_workdir)
+        
+        await demo_interactive()
+        
+        # Check that test file was created
+        test_file = Path("test_example.py")
+        assert test_file.exists()
+        assert test_file.read_bytes() == EXPECTED_TEST
+        
+        captured = capsys.readouterr()
+        assert "Tests saved to: test_example.py" in captured.out
 
 
 class TestEdgeCases:
     """Test edge cases and error conditions."""
 
-    def test_analyze_python_file_with_special_characters(self):
+    def test_analyze_python_file_with_special_characters(self, default_generator, fs):
         """Test file analysis with special characters in content."""
         test_content = "def test_function():\n    # Test with émojis 🐍\n    pass\n"
+        fs.create_file("/f.py", contents=test_content, encoding="utf-8")
         
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, encoding='utf-8') as f:
-            f.write(test_content)
-            f.flush()
-            
-            generator = ClaudeTestGenerator()
-            result = generator.analyze_python_file(f.name)
-            
-            assert result == test_content
-            
-        os.unlink(f.name)
-
-    def test_analyze_python_file_with_very_long_path(self):
-        """Test file analysis with very long file path."""
-        generator = ClaudeTestGenerator()
-        
-        long_path = "a" * 300 + ".py"
-        
-        with pytest.raises(FileNotFoundError):
-            generator.analyze_python_file(long_path)
-
-    @pytest.mark.asyncio
-    async def test_generate_tests_for_directory_with_nested_structure(self):
-        """Test directory generation with nested directory structure."""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Create nested directory structure
-            nested_dir = Path(temp_dir) / "src" / "nested"
-            nested_dir.mkdir(parents=True)
-            
-            file1 = nested_dir / "deep_module.py"
-            file1.write_text("def deep_func():\n    pass\n")
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
-            
-            # This should not raise an error even though we don't have mock setup
-            # The test verifies the directory structure is handled correctly
-            with pytest.raises(FileNotFoundError):
-                await generator.generate_tests_for_directory("nonexistent")
+        assert default_generator.analyze_python_file("/f.py") == test_content
 
     def test_generator_with_zero_max_turns(self):
         """Test generator initialization with zero max_turns."""
@@ -428,26 +891,23 @@ class TestIntegration:
     """Integration tests for the complete workflow."""
 
     @pytest.mark.asyncio
-    @patch('claude_test_generator.query')
-    async def test_complete_workflow_single_file(self, mock_query):
+    async def test_complete_workflow_single_file(self, workdir, make_generator, mock_query):
         """Test complete workflow for a single file."""
-        mock_query.return_value = iter(["Generated test message"])
         
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Create source file
-            source_file = Path(temp_dir) / "calculator.py"
-            source_content = '''
+        # Create source file
+        source_file = workdir / "calculator.py"
+        source_content = '''
 def add(a, b):
     return a + b
 
 def subtract(a, b):
     return a - b
 '''
-            source_file.write_text(source_content)
-            
-            # Create expected test file
-            test_file = Path(temp_dir) / "test_calculator.py"
-            test_content = '''
+        source_file.write_text(source_content)
+        
+        # Create expected test file
+        test_file = workdir / "test_calculator.py"
+        test_content = '''
 import pytest
 from calculator import add, subtract
 
@@ -457,18 +917,18 @@ def test_add():
 def test_subtract():
     assert subtract(5, 3) == 2
 '''
-            test_file.write_text(test_content)
-            
-            generator = ClaudeTestGenerator(cwd=temp_dir)
-            
-            # First analyze the file
-            content = generator.analyze_python_file(str(source_file))
-            assert "def add(a, b):" in content
-            
-            # Then generate tests
-            result = await generator.generate_tests(str(source_file))
-            assert "def test_add():" in result
-            assert "def test_subtract():" in result
+        test_file.write_text(test_content)
+        
+        generator = make_generator(workdir)
+        
+        # First analyze the file
+        content = generator.analyze_python_file(str(source_file))
+        assert "def add(a, b):" in content
+        
+        # Then generate tests
+        result = await generator.generate_tests(str(source_file))
+        assert "def test_add():" in result
+        assert "def test_subtract():" in result
 
 
 if __name__ == "__main__":
@@ -1,194 +1,177 @@
+import math
+import re
+import sys
+
 import pytest
 from demo_calculator import add, multiply, Calculator
 
+# Compiled once and shared by every pytest.raises(match=...) below
+NOT_NUMBERS_RE = re.compile("Arguments must be numbers")
+UNSUPPORTED_RE = re.compile("Unsupported operation")
+
+
+@pytest.fixture
+def calc():
+    """A Calculator with an empty history."""
+    calculator = Calculator()
+    yield calculator
+    calculator.history.clear()
+
 
 class TestAdd:
     """Test cases for the add function."""
     
-    def test_add_positive_numbers(self):
-        """Test adding two positive numbers."""
-        assert add(2, 3) == 5
-        assert add(10, 20) == 30
-    
-    def test_add_negative_numbers(self):
-        """Test adding negative numbers."""
-        assert add(-2, -3) == -5
-        assert add(-10, 5) == -5
-        assert add(10, -5) == 5
-    
-    def test_add_zero(self):
-        """Test adding zero."""
-        assert add(0, 5) == 5
-        assert add(5, 0) == 5
-        assert add(0, 0) == 0
-    
-    def test_add_floats(self):
-        """Test adding floating point numbers."""
-        assert add(2.5, 3.7) == 6.2
-        assert add(1.1, 2.2) == pytest.approx(3.3)
-    
-    def test_add_large_numbers(self):
-        """Test adding large numbers."""
-        assert add(1000000, 2000000) == 3000000
-    
-    def test_add_mixed_types(self):
-        """Test adding int and float."""
-        assert add(5, 2.5) == 7.5
-        assert add(3.7, 2) == 5.7
+    @pytest.mark.parametrize("a, b, expected", [
+        # Positive numbers
+        (1, 1, 2),
+        (2, 3, 5),
+        (10, 20, 30),
+        (100, 200, 300),
+        # Negative numbers
+        (-2, -3, -5),
+        (-10, 5, -5),
+        (10, -5, 5),
+        (-1, -1, -2),
+        (-10, 10, 0),
+        # Zero
+        (0, 5, 5),
+        (5, 0, 5),
+        (0, 0, 0),
+        # Floats
+        (2.5, 3.7, 6.2),
+        (1.1, 2.2, pytest.approx(3.3)),
+        (3.14, 2.86, pytest.approx(6.0)),
+        # Large numbers
+        (1000000, 2000000, 3000000),
+        (1e6, 1e6, pytest.approx(2e6)),
+        # Mixed int and float
+        (5, 2.5, 7.5),
+        (3.7, 2, 5.7),
+    ])
+    def test_add(self, a, b, expected):
+        """Test adding numbers."""
+        assert add(a, b) == expected
     
-    def test_add_non_numeric_types(self):
+    @pytest.mark.parametrize("a, b, expected", [
+        ("hello", "world", "helloworld"),
+        ([1, 2], [3, 4], [1, 2, 3, 4]),
+        ("test", 123, "test123"),
+    ])
+    def test_add_non_numeric_types(self, a, b, expected):
         """Test add function with non-numeric types (duck typing)."""
-        assert add("hello", "world") == "helloworld"
-        assert add([1, 2], [3, 4]) == [1, 2, 3, 4]
-        assert add("test", 123) == "test123"
+        assert add(a, b) == expected
 
 
 class TestMultiply:
     """Test cases for the multiply function."""
     
-    def test_multiply_positive_numbers(self):
-        """Test multiplying positive numbers."""
-        assert multiply(3, 4) == 12
-        assert multiply(5, 6) == 30
-    
-    def test_multiply_negative_numbers(self):
-        """Test multiplying negative numbers."""
-        assert multiply(-3, 4) == -12
-        assert multiply(3, -4) == -12
-        assert multiply(-3, -4) == 12
-    
-    def test_multiply_by_zero(self):
-        """Test multiplying by zero."""
-        assert multiply(5, 0) == 0
-        assert multiply(0, 5) == 0
-        assert multiply(0, 0) == 0
-    
-    def test_multiply_by_one(self):
-        """Test multiplying by one."""
-        assert multiply(5, 1) == 5
-        assert multiply(1, 5) == 5
-    
-    def test_multiply_floats(self):
-        """Test multiplying floating point numbers."""
-        assert multiply(2.5, 4.0) == 10.0
-        assert multiply(1.5, 2.5) == pytest.approx(3.75)
-    
-    def test_multiply_mixed_types(self):
-        """Test multiplying int and float."""
-        assert multiply(3, 2.5) == 7.5
-        assert multiply(2.5, 4) == 10.0
-    
-    def test_multiply_type_error_string(self):
-        """Test that strings raise TypeError."""
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply("5", 3)
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply(5, "3")
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply("5", "3")
-    
-    def test_multiply_type_error_list(self):
-        """Test that lists raise TypeError."""
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply([1, 2], 3)
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply(5, [1, 2])
-    
-    def test_multiply_type_error_none(self):
-        """Test that None raises TypeError."""
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply(None, 5)
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply(5, None)
-    
-    def test_multiply_type_error_dict(self):
-        """Test that dictionaries raise TypeError."""
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply({}, 5)
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply(5, {"key": "value"})
-    
-    def test_multiply_type_error_bool(self):
-        """Test that booleans raise TypeError."""
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply(True, 5)
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
-            multiply(5, False)
+    @pytest.mark.parametrize("a, b, expected", [
+        # Positive numbers
+        (2, 3, 6),
+        (3, 4, 12),
+        (5, 6, 30),
+        # Negative numbers
+        (-3, 4, -12),
+        (3, -4, -12),
+        (-3, -4, 12),
+        (5, -2, -10),
+        (-1, -1, 1),
+        # Zero
+        (5, 0, 0),
+        (0, 5, 0),
+        (0, 0, 0),
+        # One
+        (5, 1, 5),
+        (1, 5, 5),
+        (1, 1, 1),
+        # Floats
+        (2.5, 4.0, 10.0),
+        (1.5, 2.5, pytest.approx(3.75)),
+        (0.5, 4, pytest.approx(2.0)),
+        (1e3, 1e3, pytest.approx(1e6)),
+        # Mixed int and float
+        (3, 2.5, 7.5),
+        (2.5, 4, 10.0),
+    ])
+    def test_multiply(self, a, b, expected):
+        """Test multiplying numbers."""
+        assert multiply(a, b) == expected
+    
+    @pytest.mark.parametrize("a, b", [
+        pytest.param("5", 3, id="string-left"),
+        pytest.param(5, "3", id="string-right"),
+        pytest.param("5", "3", id="string-both"),
+        pytest.param([1, 2], 3, id="list-left"),
+        pytest.param(5, [1, 2], id="list-right"),
+        pytest.param(None, 5, id="none-left"),
+        pytest.param(5, None, id="none-right"),
+        pytest.param({}, 5, id="dict-left"),
+        pytest.param(5, {"key": "value"}, id="dict-right"),
+        pytest.param(True, 5, id="bool-left"),
+        pytest.param(5, False, id="bool-right"),
+    ])
+    def test_multiply_type_error(self, a, b):
+        """Test that non-numeric arguments raise TypeError."""
+        with pytest.raises(TypeError, match=NOT_NUMBERS_RE):
+            multiply(a, b)
 
 
 class TestCalculator:
     """Test cases for the Calculator class."""
     
-    def test_calculator_initialization(self):
+    def test_calculator_initialization(self, calc):
         """Test calculator initialization."""
-        calc = Calculator()
         assert calc.history == []
     
-    def test_calculate_add_operation(self):
+    def test_calculate_add_operation(self, calc):
         """Test calculator add operation."""
-        calc = Calculator()
         result = calc.calculate("add", 5, 3)
-        assert result == 8
-        assert len(calc.history) == 1
-        assert calc.history[0] == "5 add 3 = 8"
+        assert (result, calc.history) == (8, ["5 add 3 = 8"])
     
-    def test_calculate_multiply_operation(self):
+    def test_calculate_multiply_operation(self, calc):
         """Test calculator multiply operation."""
-        calc = Calculator()
         result = calc.calculate("multiply", 4, 6)
-        assert result == 24
-        assert len(calc.history) == 1
-        assert calc.history[0] == "4 multiply 6 = 24"
+        assert (result, calc.history) == (24, ["4 multiply 6 = 24"])
     
-    def test_calculate_multiple_operations(self):
+    def test_calculate_multiple_operations(self, calc):
         """Test multiple operations maintain history."""
-        calc = Calculator()
         calc.calculate("add", 2, 3)
         calc.calculate("multiply", 4, 5)
         calc.calculate("add", 10, -5)
         
-        assert len(calc.history) == 3
-        assert calc.history[0] == "2 add 3 = 5"
-        assert calc.history[1] == "4 multiply 5 = 20"
-        assert calc.history[2] == "10 add -5 = 5"
+        assert calc.history == ["2 add 3 = 5", "4 multiply 5 = 20", "10 add -5 = 5"]
     
-    def test_calculate_with_floats(self):
+    def test_calculate_with_floats(self, calc):
         """Test calculator with floating point numbers."""
-        calc = Calculator()
         result = calc.calculate("add", 2.5, 3.7)
-        assert result == 6.2
-        assert calc.history[0] == "2.5 add 3.7 = 6.2"
+        assert (result, calc.history) == (6.2, ["2.5 add 3.7 = 6.2"])
     
-    def test_calculate_unsupported_operation(self):
+    def test_calculate_unsupported_operation(self, calc):
         """Test that unsupported operations raise ValueError."""
-        calc = Calculator()
-        with pytest.raises(ValueError, match="Unsupported operation"):
+        with pytest.raises(ValueError, match=UNSUPPORTED_RE):
             calc.calculate("subtract", 5, 3)
-        with pytest.raises(ValueError, match="Unsupported operation"):
+        with pytest.raises(ValueError, match=UNSUPPORTED_RE):
             calc.calculate("divide", 10, 2)
-        with pytest.raises(ValueError, match="Unsupported operation"):
+        with pytest.raises(ValueError, match=UNSUPPORTED_RE):
             calc.calculate("invalid", 1, 2)
     
-    def test_calculate_multiply_type_error_propagation(self):
+    def test_calculate_multiply_type_error_propagation(self, calc):
         """Test that TypeError from multiply function propagates."""
-        calc = Calculator()
-        with pytest.raises(TypeError, match="Arguments must be numbers"):
+        with pytest.raises(TypeError, match=NOT_NUMBERS_RE):
             calc.calculate("multiply", "5", 3)
         
         # History should remain empty when operation fails
         assert len(calc.history) == 0
     
-    def test_calculate_history_not_modified_on_error(self):
+    def test_calculate_history_not_modified_on_error(self, calc):
         """Test that history is not modified when operation fails."""
-        calc = Calculator()
         calc.calculate("add", 1, 2)  # Successful operation
         
         # This should fail and not modify history
         with pytest.raises(ValueError):
             calc.calculate("invalid", 3, 4)
         
-        assert len(calc.history) == 1
-        assert calc.history[0] == "1 add 2 = 3"
+        assert calc.history == ["1 add 2 = 3"]
     
     def test_multiple_calculator_instances(self):
         """Test that multiple calculator instances have separate histories."""
@@ -198,54 +181,47 @@ class TestCalculator:
         calc1.calculate("add", 1, 2)
         calc2.calculate("multiply", 3, 4)
         
-        assert len(calc1.history) == 1
-        assert len(calc2.history) == 1
-        assert calc1.history[0] == "1 add 2 = 3"
-        assert calc2.history[0] == "3 multiply 4 = 12"
+        assert (calc1.history, calc2.history) == (["1 add 2 = 3"], ["3 multiply 4 = 12"])
+    
+    @pytest.mark.parametrize("operation, a, b, expected", [
+        ("add", 1, 2, 3),
+        ("add", -1, -2, -3),
+        ("multiply", 3, 4, 12),
+        ("multiply", -2, 5, -10),
+        ("add", 0, 0, 0),
+        ("multiply", 0, 100, 0),
+    ])
+    def test_calculator_parameterized(self, operation, a, b, expected, calc):
+        """Parameterized test for Calculator.calculate method."""
+        result = calc.calculate(operation, a, b)
+        assert (result, calc.history) == (expected, [f"{a} {operation} {b} = {expected}"])
 
 
 class TestEdgeCases:
     """Test edge cases and boundary conditions."""
     
-    def test_very_large_numbers(self):
-        """Test with very large numbers."""
-        calc = Calculator()
-        large_num = 10**100
-        result = calc.calculate("add", large_num, 1)
-        assert result == large_num + 1
-    
-    def test_very_small_numbers(self):
-        """Test with very small floating point numbers."""
-        calc = Calculator()
-        small_num = 1e-10
-        result = calc.calculate("multiply", small_num, 2)
-        assert result == pytest.approx(2e-10)
-    
-    def test_negative_zero(self):
-        """Test with negative zero."""
-        calc = Calculator()
-        result = calc.calculate("add", -0.0, 0.0)
-        assert result == 0.0
-    
-    def test_infinity_handling(self):
-        """Test behavior with infinity."""
-        calc = Calculator()
-        inf = float('inf')
-        result = calc.calculate("add", inf, 1)
-        assert result == inf
-        
-        result = calc.calculate("multiply", inf, 2)
-        assert result == inf
-    
-    def test_nan_handling(self):
-        """Test behavior with NaN."""
-        calc = Calculator()
-        nan = float('nan')
-        result = calc.calculate("add", nan, 1)
-        assert result != result  # NaN != NaN
-        
-        result = calc.calculate("multiply", nan, 2)
-        assert result != result  # NaN != NaN
+    @pytest.mark.parametrize("operation, a, b, check", [
+        pytest.param("add", 10**100, 1, lambda r: r == 10**100 + 1, id="very-large-int"),
+        pytest.param("multiply", 1e-10, 2, lambda r: r == pytest.approx(2e-10), id="very-small-float"),
+        pytest.param("add", -0.0, 0.0, lambda r: r == 0.0, id="negative-zero"),
+        pytest.param("add", math.inf, 1, lambda r: r == math.inf, id="infinity-add"),
+        pytest.param("multiply", math.inf, 2, lambda r: r == math.inf, id="infinity-multiply"),
+        pytest.param("add", math.nan, 1, math.isnan, id="nan-add"),
+        pytest.param("multiply", math.nan, 2, math.isnan, id="nan-multiply"),
+        # 1.0 + 1e-15 is not exactly representable, but stays within 1e-14
+        pytest.param("add", 1.0, 1e-15, lambda r: 1.0 <= r <= 1.0 + 1e-14, id="precision-limit"),
+        pytest.param(
+            "multiply", sys.float_info.max, 0.5,
+            lambda r: r == sys.float_info.max * 0.5, id="max-float",
+        ),
+        pytest.param(
+            "multiply", sys.float_info.min, 2.0,
+            lambda r: r == sys.float_info.min * 2.0, id="min-positive-float",
+        ),
+    ])
+    def test_calculator_extremes(self, calc, operation, a, b, check):
+        """Test calculations on extreme and special float values."""
+        assert check(calc.calculate(operation, a, b))
 
 
 class TestCalculatorAdvanced:
@@ -261,14 +237,13 @@ class TestCalculatorAdvanced:
         
         calc2.calculate("add", 10, 10)
         
-        assert len(calc1.history) == 2
-        assert len(calc2.history) == 1
-        assert calc1.history != calc2.history
+        assert (calc1.history, calc2.history) == (
+            ["1 add 1 = 2", "2 multiply 2 = 4"],
+            ["10 add 10 = 20"],
+        )
     
-    def test_calculator_history_order(self):
+    def test_calculator_history_order(self, calc):
         """Test that history maintains chronological order."""
-        calc = Calculator()
-        
         operations = [
             ("add", 1, 2),
             ("multiply", 3, 4),
@@ -283,15 +258,15 @@ class TestCalculatorAdvanced:
             assert result == expected_results[i]
         
         # Verify history order
-        assert calc.history[0] == "1 add 2 = 3"
-        assert calc.history[1] == "3 multiply 4 = 12"
-        assert calc.history[2] == "5 add 6 = 11"
-        assert calc.history[3] == "7 multiply 8 = 56"
+        assert calc.history == [
+            "1 add 2 = 3",
+            "3 multiply 4 = 12",
+            "5 add 6 = 11",
+            "7 multiply 8 = 56",
+        ]
     
-    def test_calculator_complex_workflow(self):
+    def test_calculator_complex_workflow(self, calc):
         """Test a complex calculation workflow."""
-        calc = Calculator()
-        
         # Simulate a complex calculation sequence
         a = calc.calculate("add", 10, 5)        # 15
         b = calc.calculate("multiply", a, 2)    # 30
@@ -299,19 +274,18 @@ class TestCalculatorAdvanced:
         d = calc.calculate("multiply", c, 0)    # 0
         e = calc.calculate("add", d, 100)       # 100
         
-        assert a == 15
-        assert b == 30
-        assert c == 25
-        assert d == 0
-        assert e == 100
+        assert (a, b, c, d, e) == (15, 30, 25, 0, 100)
         
-        assert len(calc.history) == 5
-        assert calc.history[-1] == "0 add 100 = 100"
+        assert calc.history == [
+            "10 add 5 = 15",
+            "15 multiply 2 = 30",
+            "30 add -5 = 25",
+            "25 multiply 0 = 0",
+            "0 add 100 = 100",
+        ]
     
-    def test_calculator_error_recovery(self):
+    def test_calculator_error_recovery(self, calc):
         """Test calculator behavior after errors."""
-        calc = Calculator()
-        
         # Successful operation
         calc.calculate("add", 1, 2)
         
@@ -327,103 +301,18 @@ class TestCalculatorAdvanced:
         calc.calculate("multiply", 3, 4)
         
         # History should only contain successful operations
-        assert len(calc.history) == 2
-        assert calc.history[0] == "1 add 2 = 3"
-        assert calc.history[1] == "3 multiply 4 = 12"
-
-
-class TestParameterizedTests:
-    """Parameterized tests for comprehensive coverage."""
-    
-    @pytest.mark.parametrize("a, b, expected", [
-        (0, 0, 0),
-        (1, 1, 2),
-        (-1, -1, -2),
-        (100, 200, 300),
-        (3.14, 2.86, 6.0),
-        (-10, 10, 0),
-        (1e6, 1e6, 2e6),
-    ])
-    def test_add_parameterized(self, a, b, expected):
-        """Parameterized test for add function."""
-        result = add(a, b)
-        if isinstance(expected, float):
-            assert result == pytest.approx(expected)
-        else:
-            assert result == expected
-    
-    @pytest.mark.parametrize("a, b, expected", [
-        (0, 0, 0),
-        (1, 1, 1),
-        (-1, -1, 1),
-        (2, 3, 6),
-        (5, -2, -10),
-        (-3, -4, 12),
-        (0.5, 4, 2.0),
-        (1e3, 1e3, 1e6),
-    ])
-    def test_multiply_parameterized(self, a, b, expected):
-        """Parameterized test for multiply function."""
-        result = multiply(a, b)
-        if isinstance(expected, float):
-            assert result == pytest.approx(expected)
-        else:
-            assert result == expected
-    
-    @pytest.mark.parametrize("operation, a, b, expected", [
-        ("add", 1, 2, 3),
-        ("add", -1, -2, -3),
-        ("multiply", 3, 4, 12),
-        ("multiply", -2, 5, -10),
-        ("add", 0, 0, 0),
-        ("multiply", 0, 100, 0),
-    ])
-    def test_calculator_parameterized(self, operation, a, b, expected):
-        """Parameterized test for Calculator.calculate method."""
-        calc = Calculator()
-        result = calc.calculate(operation, a, b)
-        assert result == expected
-        assert len(calc.history) == 1
-        assert calc.history[0] == f"{a} {operation} {b} = {expected}"
+        assert calc.history == ["1 add 2 = 3", "3 multiply 4 = 12"]
 
 
 class TestPerformanceAndBounds:
     """Test performance characteristics and boundary conditions."""
     
-    def test_large_history(self):
-        """Test calculator with large history."""
-        calc = Calculator()
-        
-        # Perform many operations
-        for i in range(100):
+    @pytest.mark.parametrize("count", [1, 3])
+    def test_history_length(self, calc, count):
+        """Test that history keeps one entry per operation, in order."""
+        for i in range(count):
             calc.calculate("add", i, i + 1)
         
-        assert len(calc.history) == 100
+        assert len(calc.history) == count
         assert calc.history[0] == "0 add 1 = 1"
-        assert calc.history[-1] == "99 add 100 = 199"
-    
-    def test_precision_limits(self):
-        """Test floating point precision limits."""
-        calc = Calculator()
-        
-        # Test with numbers at the limit of float precision
-        small = 1e-15
-        result = calc.calculate("add", 1.0, small)
-        
-        # Due to floating point precision, this might not be exactly 1.0 + 1e-15
-        assert result >= 1.0
-        assert result <= 1.0 + 1e-14
-    
-    def test_extreme_values(self):
-        """Test with extreme values."""
-        calc = Calculator()
-        
-        # Test with maximum float value
-        max_val = 1.7976931348623157e+308
-        result = calc.calculate("multiply", max_val, 0.5)
-        assert result == max_val * 0.5
-        
-        # Test with minimum positive float value
-        min_val = 2.2250738585072014e-308
-        result = calc.calculate("multiply", min_val, 2.0)
-        assert result == min_val * 2.0
\ No newline at end of file
+        assert calc.history[-1] == f"{count - 1} add {count} = {2 * count - 1}"